@@ -1,7 +1,14 @@
 from psycopg_pool import AsyncConnectionPool
-from contextlib import asynccontextmanager
+from psycopg.types.numeric import Int4
+from contextlib import asynccontextmanager, suppress
 from config import CONFIG
 from fastapi import FastAPI
+from security import warm_up_security
+from shelves import ShelfUsage, CHANNEL as SHELF_USAGE_CHANNEL
+from item_cache import ItemCache, CHANNEL as ITEM_CHANNEL
+import psycopg
+import asyncio
+import logging
 
 # Database connection string
 DB_CONFIG = CONFIG["database"]
@@ -12,11 +19,121 @@ CONNINFO = (
     f"host={DB_CONFIG['host']} "
     f"port={DB_CONFIG['port']}"
 )
+MIN_POOL_SIZE = DB_CONFIG.get("min_size", 4)
+
+# Statements run on most requests; shared with main.py so the text matches
+# what is prepared on each connection during warm-up.
+USER_PASSWORD_QUERY = "SELECT username, password FROM public.users WHERE username = %s"
+USER_ROLE_QUERY = "SELECT role FROM public.users WHERE username = %s"
+ITEM_QUERY = """
+    SELECT itemid, idescription, photo, color, isnew, haspieces, material, maincategory, subcategory
+    FROM item
+    WHERE itemid = %s
+"""
+PIECES_QUERY = """
+    SELECT piecenum, pdescription, length, width, height, roomnum, shelfnum, pnotes
+    FROM piece
+    WHERE itemid = %s
+"""
+
+# Placeholder parameters with the same types as real requests, matching no rows.
+# Prepared statements are keyed by parameter types, and psycopg types a plain int
+# by its value (int2/int4/int8), so item ids are always passed as Int4.
+HOT_STATEMENTS = [
+    (USER_PASSWORD_QUERY, ("",)),
+    (USER_ROLE_QUERY, ("",)),
+    (ITEM_QUERY, (Int4(-1),)),
+    (PIECES_QUERY, (Int4(-1),)),
+]
+
+
+async def prepare_statements(conn):
+    """Prepare the hot statements on a new pool connection."""
+    for query, params in HOT_STATEMENTS:
+        await conn.execute(query, params, prepare=True)
+    # The pool requires connections to be handed back idle
+    await conn.commit()
+
+
+async def listen_for_changes(app: FastAPI, connected: asyncio.Event):
+    """
+    Keep the in-process caches in step with writes made by any worker,
+    reconnecting on failure.
+    """
+    handlers = {
+        ITEM_CHANNEL: lambda payload: app.item_cache.invalidate(int(payload)),
+        SHELF_USAGE_CHANNEL: app.shelf_usage.apply,
+    }
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(CONNINFO, autocommit=True) as conn:
+                for channel in handlers:
+                    await conn.execute(f"LISTEN {channel}")
+                # Notifications sent while we were not listening are lost
+                if connected.is_set():
+                    app.item_cache.clear()
+                    app.shelf_usage.mark_stale()
+                connected.set()
+                async for notify in conn.notifies():
+                    handlers[notify.channel](notify.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Change listener failed: {str(e)}")
+            await asyncio.sleep(5)
+
+
+async def warm_up(app: FastAPI, listener_connected: asyncio.Event):
+    """
+    Wait for min_size connections (each prepared by `configure`), then prime caches
+    once the listener is up, so no change between loading and listening is lost.
+    Retries until it succeeds; /readyz reports ready only afterwards.
+    """
+    while True:
+        try:
+            await app.async_pool.wait()
+            await listener_connected.wait()
+            await app.shelf_usage.refresh(app.async_pool)
+            warm_up_security()
+            break
+        except Exception as e:
+            logging.error(f"Warm-up failed, retrying: {str(e)}")
+            await asyncio.sleep(5)
+    app.ready = True
+    logging.info("Warm-up complete, ready to serve traffic")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Manage the connection pool lifecycle."""
-    app.async_pool = AsyncConnectionPool(conninfo=CONNINFO, max_size=20)
-    yield
-    await app.async_pool.close()
+    """
+    Manage the connection pool lifecycle. Warm-up runs in the background so the
+    server starts listening (and /healthz answers) while it is in progress.
+    """
+    app.ready = False
+    app.async_pool = AsyncConnectionPool(
+        conninfo=CONNINFO,
+        min_size=MIN_POOL_SIZE,
+        max_size=20,
+        configure=prepare_statements,
+        # Discard connections broken by a database restart instead of handing them out
+        check=AsyncConnectionPool.check_connection,
+        open=False,
+    )
+    app.shelf_usage = ShelfUsage()
+    app.item_cache = ItemCache()
+    await app.async_pool.open()
+    listener_connected = asyncio.Event()
+    tasks = [
+        asyncio.create_task(listen_for_changes(app, listener_connected)),
+        asyncio.create_task(warm_up(app, listener_connected)),
+    ]
+
+    try:
+        yield
+    finally:
+        app.ready = False
+        for task in tasks:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        await app.async_pool.close()
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from config import CONFIG
+
+CACHE_CONFIG = CONFIG.get("item_cache", {})
+MAX_BYTES = CACHE_CONFIG.get("max_bytes", 16 * 1024 * 1024)
+MAX_ENTRIES = CACHE_CONFIG.get("max_entries", 10_000)
+
+# Postgres channel carrying the ids of items whose item/piece rows changed
+CHANNEL = "item_changed"
+
+
+class ItemCache:
+    """
+    LRU cache of serialized /item/{id} responses, bounded by entry count and total bytes.
+    """
+
+    def __init__(self, max_bytes: int = MAX_BYTES, max_entries: int = MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # Bumped on every invalidation, so a response read before one is not cached after it
+        self.generation = 0
+
+    def get(self, item_id: int):
+        body = self.entries.get(item_id)
+        if body is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(item_id)
+        self.hits += 1
+        return body
+
+    def put(self, item_id: int, body: bytes, generation: int):
+        if generation != self.generation or len(body) > self.max_bytes:
+            return
+        old = self.entries.pop(item_id, None)
+        if old is not None:
+            self.size -= len(old)
+        self.entries[item_id] = body
+        self.size += len(body)
+        while self.size > self.max_bytes or len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def invalidate(self, item_id: int):
+        self.generation += 1
+        body = self.entries.pop(item_id, None)
+        if body is not None:
+            self.size -= len(body)
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "maxBytes": self.max_bytes,
+            "maxEntries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+async def notify_item_changed(cur, item_id: int):
+    """Tell every worker to drop item_id from its cache; delivered when the transaction commits."""
+    await cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, str(item_id)))
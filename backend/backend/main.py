@@ -1,13 +1,17 @@
 from fastapi import FastAPI, HTTPException, Form, Depends
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.security import OAuth2PasswordBearer
 from pathlib import Path
 from config import CONFIG
-from db import lifespan
+from psycopg.types.numeric import Int4
+from db import lifespan, USER_PASSWORD_QUERY, USER_ROLE_QUERY, ITEM_QUERY, PIECES_QUERY
 from security import hash_password, verify_password, create_access_token, decode_access_token
+from shelves import validate_piece, notify_shelf_usage, MAX_SUGGESTIONS
+from item_cache import notify_item_changed
 from datetime import datetime
 import logging
+import json
 
 logging.basicConfig(level=logging.INFO)
 
@@ -56,29 +60,29 @@ async def find_item_and_pieces(item_id: int, current_user: str = Depends(get_cur
     """
     Fetch an item by item_id and its associated pieces (if any).
     Always returns the item details, even if there are no pieces.
+    Responses are served from the item cache when possible.
     """
+    # item.itemid is an int4 column; larger ids can't exist and would fail to bind as Int4
+    if not -2**31 <= item_id < 2**31:
+        raise HTTPException(status_code=404, detail="Item not found for the given item_id")
+
+    cached = app.item_cache.get(item_id)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
+    generation = app.item_cache.generation
     try:
         async with app.async_pool.connection() as conn:
             async with conn.cursor() as cur:
                 # Step 1: Check if the item exists
-                item_query = """
-                    SELECT itemid, idescription, photo, color, isnew, haspieces, material, maincategory, subcategory
-                    FROM item
-                    WHERE itemid = %s
-                """
-                await cur.execute(item_query, (item_id,))
+                await cur.execute(ITEM_QUERY, (Int4(item_id),))
                 item = await cur.fetchone()
 
                 if not item:
                     raise HTTPException(status_code=404, detail="Item not found for the given item_id")
 
                 # Step 2: Fetch associated pieces
-                pieces_query = """
-                    SELECT piecenum, pdescription, length, width, height, roomnum, shelfnum, pnotes
-                    FROM piece
-                    WHERE itemid = %s
-                """
-                await cur.execute(pieces_query, (item_id,))
+                await cur.execute(PIECES_QUERY, (Int4(item_id),))
                 pieces = await cur.fetchall()
 
                 # Step 3: Prepare the response
@@ -107,7 +111,10 @@ async def find_item_and_pieces(item_id: int, current_user: str = Depends(get_cur
                     ],
                 }
 
-                return {"success": True, "item": item_data}
+                # Rendered exactly as FastAPI would, so cached and uncached bodies match
+                body = JSONResponse({"success": True, "item": item_data}).body
+                app.item_cache.put(item_id, body, generation)
+                return Response(content=body, media_type="application/json")
 
     except HTTPException as e:
         # Re-raise HTTP exceptions
@@ -178,10 +185,9 @@ async def login(
     """
     try:
         # Fetch user data from the database
-        query = "SELECT username, password FROM public.users WHERE username = %s"
         async with app.async_pool.connection() as conn:
             async with conn.cursor() as cur:
-                await cur.execute(query, (username,))
+                await cur.execute(USER_PASSWORD_QUERY, (username,))
                 user = await cur.fetchone()
                 if not user:
                     raise HTTPException(status_code=400, detail="Invalid username or password")
@@ -344,10 +350,7 @@ async def accept_donation(
             async with conn.transaction():  # Start a transaction
                 async with conn.cursor() as cur:
                     # a. Verify the user is a staff member
-                    query_role_check = """
-                        SELECT role FROM public.users WHERE username = %s
-                    """
-                    await cur.execute(query_role_check, (staff_username,))
+                    await cur.execute(USER_ROLE_QUERY, (staff_username,))
                     user_role = await cur.fetchone()
 
                     if not user_role or user_role[0] != "staff":
@@ -381,12 +384,14 @@ async def accept_donation(
                     await cur.execute(query_insert_donation, (item_id, donor_username, datetime.utcnow().date()))
 
                     # e. Insert pieces and their locations into the `Piece` table
+                    inserted_pieces = []
                     if piece_data:
                         try:
                             piece_data_list = eval(piece_data) if isinstance(piece_data, str) else piece_data
                             query_insert_piece = """
                                 INSERT INTO public.piece (ItemID, pieceNum, pDescription, length, width, height, roomNum, shelfNum, pNotes)
                                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                                RETURNING roomNum, shelfNum, length, width, height
                             """
                             for piece in piece_data_list:
                                 await cur.execute(query_insert_piece, (
@@ -394,12 +399,22 @@ async def accept_donation(
                                     piece["width"], piece["height"], piece["roomNum"], piece["shelfNum"],
                                     piece.get("pNotes", None)
                                 ))
+                                # Stored values, as Postgres rounds non-integer dimensions
+                                row = await cur.fetchone()
+                                inserted_pieces.append(
+                                    {"roomNum": row[0], "shelfNum": row[1], "length": row[2], "width": row[3], "height": row[4]}
+                                )
                         except Exception as e:
                             logging.error(f"Invalid piece data: {piece_data}")
                             raise HTTPException(status_code=400, detail="Invalid piece data provided.")
 
-                # If all steps succeed, the transaction is automatically committed.
-                return {"success": True, "message": "Donation accepted successfully", "item_id": item_id}
+                    # f. Invalidate cached copies of this item and update shelf usage in every worker
+                    await notify_item_changed(cur, item_id)
+                    await notify_shelf_usage(cur, inserted_pieces)
+
+        # If all steps succeed, the transaction is automatically committed.
+        app.item_cache.invalidate(item_id)
+        return {"success": True, "message": "Donation accepted successfully", "item_id": item_id}
 
     except HTTPException as e:
         # Rollback happens automatically on an exception
@@ -412,9 +427,8 @@ async def accept_donation(
 
 # Utility to validate staff role
 async def validate_staff_role(current_user: str, conn) -> bool:
-    query = "SELECT role FROM users WHERE username = %s"
     async with conn.cursor() as cur:
-        await cur.execute(query, (current_user,))
+        await cur.execute(USER_ROLE_QUERY, (current_user,))
         user_role = await cur.fetchone()
         if user_role and user_role[0] == "staff":
             return True
@@ -524,22 +538,41 @@ async def add_to_order(
     """
     try:
         # Check if the user is a staff member
-        query_role_check = "SELECT role FROM public.users WHERE username = %s"
         async with app.async_pool.connection() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(query_role_check, (staff_username,))
-                user_role = await cur.fetchone()
-                if not user_role or user_role[0] != "staff":
-                    raise HTTPException(status_code=403, detail="Unauthorized: Only staff can add items to orders")
-
-                # Add the item to the order
-                query_add_item = """
-                    INSERT INTO public.itemin (ItemID, orderID, found)
-                    VALUES (%s, %s, FALSE)
-                """
-                await cur.execute(query_add_item, (item_id, current_order_id))
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    await cur.execute(USER_ROLE_QUERY, (staff_username,))
+                    user_role = await cur.fetchone()
+                    if not user_role or user_role[0] != "staff":
+                        raise HTTPException(status_code=403, detail="Unauthorized: Only staff can add items to orders")
+
+                    # Lock the item so concurrent adds of it see each other's itemin row
+                    await cur.execute("SELECT ItemID FROM public.item WHERE ItemID = %s FOR UPDATE", (item_id,))
+                    if not await cur.fetchone():
+                        raise HTTPException(status_code=404, detail="Item not found")
+
+                    # Pieces that leave their shelves, unless the item is already in another order
+                    query_pieces = """
+                        SELECT roomNum, shelfNum, length, width, height
+                        FROM public.piece
+                        WHERE ItemID = %s AND NOT EXISTS (SELECT 1 FROM public.itemin WHERE ItemID = %s)
+                    """
+                    await cur.execute(query_pieces, (item_id, item_id))
+                    pieces = await cur.fetchall()
+
+                    # Add the item to the order
+                    query_add_item = """
+                        INSERT INTO public.itemin (ItemID, orderID, found)
+                        VALUES (%s, %s, FALSE)
+                    """
+                    await cur.execute(query_add_item, (item_id, current_order_id))
 
-                return {"success": True, "message": "Item added to the order successfully"}
+                    await notify_shelf_usage(cur, [
+                        {"roomNum": row[0], "shelfNum": row[1], "length": row[2], "width": row[3], "height": row[4]}
+                        for row in pieces
+                    ], sign=-1)
+
+        return {"success": True, "message": "Item added to the order successfully"}
 
     except HTTPException as e:
         raise e
@@ -626,6 +659,83 @@ async def get_shelves(room_num: int):
         raise HTTPException(status_code=500, detail="An error occurred while fetching shelves.")
 
 
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness check: the process is up and serving requests.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness check: warm-up has finished and the database answers through the pool.
+    The probe only borrows a connection that is idle, so a busy pool doesn't make it
+    compete with real requests.
+    """
+    if not getattr(app, "ready", False):
+        raise HTTPException(status_code=503, detail="Warming up")
+
+    stats = app.async_pool.get_stats()
+    if app.async_pool.closed or stats.get("pool_size", 0) == 0:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    if stats.get("pool_available", 0) > 0:
+        try:
+            async with app.async_pool.connection(timeout=1) as conn:
+                await conn.execute("SELECT 1")
+        except Exception as e:
+            logging.error(f"Readiness check failed: {str(e)}")
+            raise HTTPException(status_code=503, detail="Database unavailable")
+
+    return {
+        "status": "ready",
+        "pool": {
+            "size": stats.get("pool_size"),
+            "available": stats.get("pool_available"),
+            "waiting": stats.get("requests_waiting", 0),
+        },
+    }
+
+
+@app.get("/admin/item-cache")
+async def get_item_cache_stats(current_user: str = Depends(get_current_user)):
+    """
+    Report item cache size and hit ratio. Only staff can view this.
+    """
+    async with app.async_pool.connection() as conn:
+        if not await validate_staff_role(current_user, conn):
+            raise HTTPException(status_code=403, detail="Unauthorized: Only staff can view cache stats.")
+    return {"success": True, "itemCache": app.item_cache.stats()}
+
+
+@app.post("/shelf-suggestions")
+async def suggest_shelves(
+    piece_data: str = Form(...),
+    limit: int = Form(3),
+    current_user: str = Depends(get_current_user),
+):
+    """
+    Suggest best-fit shelves for a set of pieces, based on the volume already used on each shelf.
+    """
+    if not 1 <= limit <= MAX_SUGGESTIONS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_SUGGESTIONS}.")
+
+    try:
+        pieces = json.loads(piece_data)
+        for piece in pieces:
+            validate_piece(piece)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid piece data provided.")
+
+    try:
+        await app.shelf_usage.ensure_loaded(app.async_pool)
+        return {"success": True, "pieces": app.shelf_usage.suggest(pieces, limit)}
+    except Exception as e:
+        logging.error(f"Error suggesting shelves: {str(e)}")
+        raise HTTPException(status_code=500, detail="An error occurred while suggesting shelves.")
+
+
 @app.get("/{full_path:path}")
 async def catch_all(full_path: str):
     return FileResponse(index_path)
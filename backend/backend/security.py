@@ -40,3 +40,10 @@ def decode_access_token(token: str):
         return payload
     except JWTError as e:
         raise HTTPException(status_code=401, detail="Invalid token")
+
+
+def warm_up_security():
+    """Run a trial hash/verify and token round trip so the first login doesn't pay for backend setup."""
+    hashed = hash_password("warm-up")
+    verify_password("warm-up", hashed)
+    decode_access_token(create_access_token(data={"sub": "warm-up"}))
@@ -0,0 +1,181 @@
+from bisect import bisect_left, insort
+from config import CONFIG
+import asyncio
+import json
+import logging
+
+# Volume a single shelf can hold, in the same units as piece length * width * height
+SHELF_CAPACITY = CONFIG.get("shelves", {}).get("capacity", 1_000_000)
+
+# Most shelves /shelf-suggestions may return per piece
+MAX_SUGGESTIONS = 20
+
+# Used volume per shelf, counting only pieces whose item has not been ordered
+USAGE_QUERY = """
+    SELECT l.roomnum, l.shelfnum, l.shelfdescription,
+           COALESCE(SUM(p.length::bigint * p.width * p.height), 0)
+    FROM public.location l
+    LEFT JOIN public.piece p
+        ON p.roomnum = l.roomnum AND p.shelfnum = l.shelfnum
+        AND NOT EXISTS (SELECT 1 FROM public.itemin ii WHERE ii.itemid = p.itemid)
+    GROUP BY l.roomnum, l.shelfnum, l.shelfdescription
+"""
+
+# Postgres channel carrying per-shelf volume changes, so every worker applies every write
+CHANNEL = "shelf_usage_changed"
+
+
+def piece_volume(piece: dict) -> int:
+    """Return the volume of a piece given as a dict with length, width and height."""
+    return int(piece["length"]) * int(piece["width"]) * int(piece["height"])
+
+
+def validate_piece(piece: dict):
+    """Raise ValueError unless length, width and height are all positive integers."""
+    for dimension in ("length", "width", "height"):
+        value = piece[dimension]
+        if isinstance(value, bool) or int(value) != float(value) or int(value) <= 0:
+            raise ValueError(f"{dimension} must be a positive integer")
+
+
+async def notify_shelf_usage(cur, pieces: list, sign: int = 1):
+    """
+    Publish the volume `pieces` add to (sign=1) or free from (sign=-1) their shelves.
+    Delivered when the transaction commits, tagged with its transaction id.
+    """
+    deltas = {}
+    for piece in pieces:
+        key = (int(piece["roomNum"]), int(piece["shelfNum"]))
+        deltas[key] = deltas.get(key, 0) + sign * piece_volume(piece)
+    if not deltas:
+        return
+    payload = json.dumps([[room, shelf, volume] for (room, shelf), volume in deltas.items()])
+    await cur.execute(
+        "SELECT pg_notify(%s, pg_current_xact_id()::text || ' ' || %s)",
+        (CHANNEL, payload),
+    )
+
+
+def visible_in_snapshot(xid: int, snapshot: str) -> bool:
+    """Whether transaction xid had committed as of a pg_current_snapshot() value."""
+    xmin, xmax, xip = snapshot.split(":")
+    if xid < int(xmin):
+        return True
+    return xid < int(xmax) and str(xid) not in xip.split(",")
+
+
+class ShelfUsage:
+    """
+    In-memory view of how much volume is used on each shelf.
+    Loaded from the database, then kept current in every worker by the
+    changes the write paths publish on CHANNEL.
+    """
+
+    def __init__(self, capacity: int = SHELF_CAPACITY):
+        self.capacity = capacity
+        self.used = {}
+        self.descriptions = {}
+        self.loaded = False
+        # Snapshot the usage was loaded at; changes already in it are not applied again
+        self.snapshot = None
+        # Changes received while a refresh is running, replayed once it finishes
+        self._pending = None
+        self._missed = False
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, pool):
+        """Recompute usage for every shelf with a single aggregate query."""
+        async with self._lock:
+            await self._load(pool)
+
+    async def ensure_loaded(self, pool):
+        if not self.loaded:
+            async with self._lock:
+                # Requests that queued behind a reload reuse its result
+                if not self.loaded:
+                    await self._load(pool)
+
+    async def _load(self, pool):
+        self._pending = []
+        self._missed = False
+        try:
+            async with pool.connection() as conn:
+                async with conn.transaction():
+                    async with conn.cursor() as cur:
+                        # Read the usage and the snapshot it reflects at the same point in time
+                        await cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                        await cur.execute(USAGE_QUERY)
+                        rows = await cur.fetchall()
+                        await cur.execute("SELECT pg_current_snapshot()::text")
+                        snapshot = (await cur.fetchone())[0]
+
+            self.used = {(row[0], row[1]): row[3] for row in rows}
+            self.descriptions = {(row[0], row[1]): row[2] for row in rows}
+            self.snapshot = snapshot
+            self.loaded = not self._missed
+        finally:
+            # Detach the buffer first, or apply() would append to the list being replayed
+            pending, self._pending = self._pending, None
+        for payload in pending:
+            self.apply(payload)
+        logging.info(f"Loaded shelf usage for {len(self.used)} shelves")
+
+    def mark_stale(self):
+        """Force a reload on next use, e.g. after changes may have been missed."""
+        self._missed = True
+        self.loaded = False
+
+    def apply(self, payload: str):
+        """Apply a change published by notify_shelf_usage."""
+        if self._pending is not None:
+            self._pending.append(payload)
+            return
+        if not self.loaded:
+            return
+        xid, deltas = payload.split(" ", 1)
+        if visible_in_snapshot(int(xid), self.snapshot):
+            return
+        for room_num, shelf_num, volume in json.loads(deltas):
+            key = (room_num, shelf_num)
+            self.used[key] = self.used.get(key, 0) + volume
+
+    def shelf_info(self, key: tuple, used: int) -> dict:
+        return {
+            "roomNum": key[0],
+            "shelfNum": key[1],
+            "shelfDescription": self.descriptions.get(key),
+            "usedVolume": used,
+            "freeVolume": self.capacity - used,
+        }
+
+    def suggest(self, pieces: list, limit: int = 3) -> list:
+        """
+        Suggest best-fit shelves for a set of pieces.
+        Pieces are placed largest first on the shelf with the least free space
+        that still fits them, so later pieces see the space taken by earlier ones.
+        """
+        used = dict(self.used)
+        # Shelves ordered by free volume, for binary search on the smallest fit
+        free = sorted((self.capacity - volume, key) for key, volume in used.items())
+
+        suggestions = {}
+        for index in sorted(range(len(pieces)), key=lambda i: piece_volume(pieces[i]), reverse=True):
+            volume = piece_volume(pieces[index])
+            start = bisect_left(free, (volume,))
+            candidates = free[start:start + limit]
+            suggestions[index] = [self.shelf_info(key, used[key]) for _, key in candidates]
+
+            if candidates:
+                best_free, best_key = candidates[0]
+                del free[start]
+                used[best_key] += volume
+                insort(free, (best_free - volume, best_key))
+
+        return [
+            {
+                "pieceNum": pieces[index].get("pieceNum"),
+                "volume": piece_volume(pieces[index]),
+                "suggestions": suggestions[index],
+            }
+            for index in range(len(pieces))
+        ]